@@ -1,20 +1,31 @@
-from fastapi import FastAPI
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, Request
+from pydantic import BaseModel, ConfigDict, Field
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import HTTPException
-from utils.loader import load_recipes_from_file, get_recipe_by_id, attach_recipe_images
-from utils.embeddings_helper import add_recipe_embedding, find_similar_recipes
-from utils.ai_agent import query_nim
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from utils.loader import load_recipes_from_file, get_file_hash, get_recipe_by_id, attach_recipe_images_cached, precompute_recipe_images, build_recipe_index, build_token_index, build_search_blobs, tokenize
+from utils.embeddings_helper import add_recipe_embeddings_batch, find_similar_by_embedding, embed_query, close_embed_batcher, load_embedding_index, save_embedding_index, embedding_build_lock
+from utils.ai_agent import aquery_nim, close_async_client, ID_LIST_MAX_TOKENS
+from utils.nim_cache import lookup_cached_response, cache_response
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
 
+import asyncio
+import hashlib
 import random
-import json
+import orjson
+import logging
+import threading
 import os
 
 load_dotenv()
 NIM_KEY = os.getenv("NIM_KEY")
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
 
 tags_metadata = [
     {
@@ -29,8 +40,38 @@ tags_metadata = [
         "name": "Recipes",
         "description": "Access recipes, details, and images."
     },
+    {
+        "name": "Batch",
+        "description": "Run several API calls in a single round-trip."
+    },
 ]
 
+# Set once the recipe embeddings are loaded (or warmup is skipped); semantic search waits for it
+EMBEDDINGS_READY = threading.Event()
+# Set on shutdown: an embedding build still running stops sending batches to the NIM
+EMBEDDINGS_BUILD_STOP = threading.Event()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Set SKIP_WARMUP=1 in development (e.g. with --reload) to start without recipe embeddings
+    warmup = None
+    if os.getenv("SKIP_WARMUP"):
+        logger.info("⏭️ SKIP_WARMUP set — recipe embeddings not loaded")
+        EMBEDDINGS_READY.set()
+    else:
+        # Build in the background so the server (and /health, /docs) answers immediately
+        warmup = asyncio.create_task(asyncio.to_thread(build_recipe_embeddings))
+        warmup.add_done_callback(lambda _: EMBEDDINGS_READY.set())
+    yield
+    if warmup is not None and not warmup.done():
+        # Cancelling can't stop the build thread: ask it to stop, then wait for its in-flight
+        # NIM calls so it releases the build lock before the worker exits
+        EMBEDDINGS_BUILD_STOP.set()
+        await asyncio.gather(warmup, return_exceptions=True)
+    # Release pooled NIM connections and the query embedding batcher on shutdown
+    await close_async_client()
+    await close_embed_batcher()
+
 app = FastAPI(
     title="CulinAIry Agentic API",
     description="""
@@ -41,6 +82,8 @@ Built for the **AWS + NVIDIA Agentic AI Hackathon**.
 """,
     version="1.0.1",
     openapi_tags=tags_metadata,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     contact={
         "name": "CulinAIry Team",
         "url": "https://github.com/JavierMedel/culinairy-agentic",
@@ -56,7 +99,7 @@ IMAGE_DIR = os.path.join(os.path.dirname(__file__), "images")
 if os.path.exists(IMAGE_DIR):
     app.mount("/images", StaticFiles(directory=IMAGE_DIR), name="images")
 else:
-    print("⚠️ Warning: 'images' folder not found — static serving disabled.")
+    logger.warning("⚠️ 'images' folder not found — static serving disabled.")
 
 # ------------------------------------------------------
 # 🌐 CORS Settings
@@ -72,21 +115,172 @@ app.add_middleware(
 # ------------------------------------------------------
 # 📦 Data Load
 # ------------------------------------------------------
-RECIPES = load_recipes_from_file("recipes_updated.json")
+RECIPES_FILE = "recipes_updated.json"
+RECIPES = load_recipes_from_file(RECIPES_FILE)
+
+# Lowercased title + cuisine + tag names per recipe, computed once so preference filtering
+# is a plain substring scan (kept out of the recipe dicts so it never leaks into responses)
+RECIPE_SEARCH_BLOBS = build_search_blobs(RECIPES)
+
+# id / id_legacy -> recipe, so selected IDs resolve with a dict lookup instead of a list scan
+RECIPES_BY_ID = build_recipe_index(RECIPES)
+
+# Inverted index of title/cuisine tokens (and word pairs) -> recipe positions
+TOKEN_INDEX = build_token_index(RECIPES)
 
-print("⚡ Generating embeddings for recipes... (this may take a few minutes)")
-for r in RECIPES:
-    add_recipe_embedding(r["id_legacy"], r["title"] + " " + r.get("description", ""))
+# Image URLs for every recipe, built once (recipes and images don't change at runtime)
+precompute_recipe_images(RECIPES)
 
-print("✅ Recipe embeddings ready!")
-# print(find_similar_recipes("Low-carb Italian chicken dinner"))
+# Each recipe (images attached) encoded once with its ETag, so /recipes and /recipe/{id}
+# never re-serialize static data and can answer revalidations with a 304
+RECIPE_JSON = [orjson.dumps(attach_recipe_images_cached(r)) for r in RECIPES]
+RECIPE_ETAGS = [f'"{hashlib.md5(body).hexdigest()}"' for body in RECIPE_JSON]
+_recipe_positions = {id(r): i for i, r in enumerate(RECIPES)}
+RECIPE_POSITIONS = {recipe_id: _recipe_positions[id(r)] for recipe_id, r in RECIPES_BY_ID.items()}
+RECIPES_ETAG = hashlib.md5("".join(RECIPE_ETAGS).encode()).hexdigest()
+RECIPE_CACHE_CONTROL = "public, max-age=300"
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    True if the client's If-None-Match already names this ETag.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+def build_recipe_embeddings():
+    """
+    Load the embeddings persisted by a previous boot while recipes_updated.json is unchanged,
+    otherwise generate them through the embeddings NIM and persist them.
+    Runs from the app lifespan, not at import, so importing the app stays cheap.
+    """
+    if not RECIPES:
+        return
+
+    recipes_hash = get_file_hash(RECIPES_FILE)
+    if load_embedding_index(recipes_hash):
+        logger.info("✅ Loaded cached embeddings for %d recipes", len(RECIPES))
+        return
+
+    with embedding_build_lock():
+        # Another worker may have built and saved the index while we waited for the lock
+        if load_embedding_index(recipes_hash):
+            logger.info("✅ Loaded embeddings built by another worker for %d recipes", len(RECIPES))
+            return
+
+        logger.info("⚡ Generating embeddings for %d recipes... (this may take a few minutes)", len(RECIPES))
+        added = add_recipe_embeddings_batch(
+            [r["id_legacy"] for r in RECIPES],
+            [r["title"] + " " + r.get("description", "") for r in RECIPES],
+            stop=EMBEDDINGS_BUILD_STOP,
+        )
+        # Only persist complete builds, so a partial NIM outage isn't cached; then
+        # re-open the saved copy memory-mapped so this worker shares pages with the others
+        if added == len(RECIPES) and save_embedding_index(recipes_hash):
+            load_embedding_index(recipes_hash)
+    if EMBEDDINGS_BUILD_STOP.is_set():
+        logger.info("⏹️ Embedding build stopped at shutdown (%d/%d)", added, len(RECIPES))
+        return
+    logger.info("✅ Recipe embeddings ready! (%d/%d)", added, len(RECIPES))
+
+# Min recipes passed to the LLM as context for a meal plan (it gets 2 candidates per meal slot)
+PLAN_CONTEXT_SIZE = 5
+# Completion tokens budgeted per selected recipe ID in a meal plan
+PLAN_TOKENS_PER_ID = 20
+
+# The LLM only needs recall cues: cap the longest fields of each context entry (fewer prompt tokens)
+CONTEXT_DESCRIPTION_CHARS = 120
+CONTEXT_INGREDIENTS = 8
+
+def build_recipe_context(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Trimmed recipe summary sent to the LLM as context.
+    """
+    description = recipe.get("description", "")
+    if len(description) > CONTEXT_DESCRIPTION_CHARS:
+        description = description[:CONTEXT_DESCRIPTION_CHARS].rstrip() + "…"
+    return {
+        "id": recipe.get("id_legacy") or recipe.get("id"),
+        "title": recipe.get("title"),
+        "description": description,
+        "ingredients": [ing.get("name") for ing in recipe.get("ingredients", [])[:CONTEXT_INGREDIENTS]],
+        "utensils": recipe.get("utensils", []),
+        "tags": recipe.get("tags", []),
+    }
+
+# recipe ID -> LLM context entry, and the same entry pre-serialized as a JSON fragment,
+# so prompts are assembled by joining strings instead of rebuilding and re-encoding dicts
+RECIPE_CONTEXT_INDEX = {key: build_recipe_context(r) for key, r in RECIPES_BY_ID.items()}
+RECIPE_CONTEXT_JSON = {key: orjson.dumps(ctx).decode() for key, ctx in RECIPE_CONTEXT_INDEX.items()}
+
+# Large meal plans (up to 2 candidates x 35 slots) would send 70 full entries: past this many
+# recipes, each one is reduced to its id, title and tags
+COMPACT_CONTEXT_MIN_SIZE = 20
+RECIPE_CONTEXT_COMPACT_JSON = {
+    key: orjson.dumps({k: ctx[k] for k in ("id", "title", "tags")}).decode()
+    for key, ctx in RECIPE_CONTEXT_INDEX.items()
+}
+
+def serialize_recipe_context(recipe_ids: List[str]) -> str:
+    """
+    JSON array of the context entries for the given recipe IDs (unknown IDs are skipped).
+    More than COMPACT_CONTEXT_MIN_SIZE IDs get the compact id/title/tags entries.
+    """
+    entries = RECIPE_CONTEXT_COMPACT_JSON if len(recipe_ids) > COMPACT_CONTEXT_MIN_SIZE else RECIPE_CONTEXT_JSON
+    return "[" + ",".join(entries[r] for r in recipe_ids if r in entries) + "]"
+
+def filter_recipes_by_preferences(preferences: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """
+    Return recipes whose title, cuisine or tags match any of the given preferences.
+    Uses the token index; only falls back to a substring scan for preferences
+    that contain words the index has never seen.
+    """
+    matched = set()
+    for pref in preferences:
+        whole = pref.strip().lower()
+        if whole in TOKEN_INDEX:
+            matched |= TOKEN_INDEX[whole]
+            continue
+        tokens = tokenize(pref)
+        keys = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] or tokens
+        if keys and all(k in TOKEN_INDEX for k in keys):
+            matched |= set.intersection(*(TOKEN_INDEX[k] for k in keys))
+        else:
+            pref_lower = pref.lower()
+            matched.update(i for i, blob in enumerate(RECIPE_SEARCH_BLOBS) if pref_lower in blob)
+    return [RECIPES[i] for i in sorted(matched)]
+
+def sample_recipes(pool: list, k: int) -> list:
+    """
+    Draw k items from the pool without repeats when it is large enough, otherwise with replacement.
+    """
+    return random.sample(pool, k) if len(pool) >= k else random.choices(pool, k=k)
+
+def known_recipe_ids(ids: Any, candidates: List[str]) -> List[str]:
+    """
+    The IDs of an LLM selection that name one of the retrieved candidates, deduplicated, in order.
+    Raises ValueError if none do, so callers fall back instead of returning (or caching) made-up IDs.
+    """
+    if not isinstance(ids, list):
+        raise ValueError(f"expected a list of recipe IDs, got {type(ids).__name__}")
+    allowed = {c for c in candidates if c in RECIPE_CONTEXT_INDEX}
+    selected = list(dict.fromkeys(i for i in ids if isinstance(i, str) and i in allowed))
+    if not selected:
+        raise ValueError("no retrieved recipe IDs in the LLM selection")
+    return selected
 
 class MealRequest(BaseModel):
+    # Frozen (and tuple preferences) so a request is hashable and usable as a cache key
+    model_config = ConfigDict(frozen=True)
+
     meals_per_day: int = Field(..., gt=0, le=5, description="Number of meals per day")
     days: int = Field(..., gt=0, le=7, description="Number of days to plan meals for")
-    preferences: List[str] = Field(default_factory=list, description="List of user preferences or dietary tags") # e.g., ["low carb", "chicken", "italian"]
+    preferences: Tuple[str, ...] = Field(default_factory=tuple, description="List of user preferences or dietary tags") # e.g., ["low carb", "chicken", "italian"]
 
 class RecipeSearchRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     query: str = Field(..., description="User search query for recipes")
     top_k: int = Field(3, gt=0, le=10, description="Number of top recipes to return")
 
@@ -111,55 +305,8 @@ class MealPlan(BaseModel):
     day: int
     meals: List[Dict[str, Any]]
     
-@app.post(
-    "/plan-meals",
-    tags=["Meal Planner"],
-    summary="Generate a meal plan",
-    description="""
-    🧠 Generate a meal plan using available recipes.  
-    Filters recipes by preferences (optional), then organizes them by day and meal.
-    
-    Example:
-    ```json
-    {
-      "meals_per_day": 2,
-      "days": 3,
-      "preferences": ["low carb", "mexican"]
-    }
-    ```
-    """,
-    response_model=Dict[str, Any],
-     responses={
-        200: {
-            "description": "Meal plan successfully generated",
-            "content": {
-                "application/json": {
-                    "example": {
-                        "summary": {
-                            "days": 3,
-                            "meals_per_day": 2,
-                            "preferences": ["low carb", "mexican"],
-                            "total_recipes": 18
-                        },
-                        "plan": [
-                            {
-                                "day": 1,
-                                "meals": [
-                                    {"title": "Low-Carb Tex-Mex Beef Bowl", "cousine": "Tex-Mex"},
-                                    {"title": "Chicken Caesar Salad", "cousine": "American"}
-                                ]
-                            }
-                        ]
-                    }
-                }
-            },
-        }
-    },
-)
-
-
 @app.post("/search-recipes", tags=["Recipes Agentic Search"])
-def search_recipes(request: RecipeSearchRequest):
+async def search_recipes(request: RecipeSearchRequest):
     """
     Search recipes using embeddings + LLM reasoning (RAG pattern).
     Steps:
@@ -173,38 +320,40 @@ def search_recipes(request: RecipeSearchRequest):
     # Step 1: Build semantic query
     # -----------------------
     user_query = request.query.strip() if request.query else "balanced meals"
-    print(f"🔍 User query: {user_query}")
+    logger.debug("🔍 User query: %s", user_query)
+
+    if not EMBEDDINGS_READY.is_set():
+        raise HTTPException(status_code=503, detail="Recipe embeddings are still loading, try again shortly")
+
+    # Embed the query once (batched with concurrent requests) for both the cache and the vector search
+    query_embedding = await embed_query(user_query)
+
+    # A semantically equivalent query was already answered: skip retrieval and the LLM entirely
+    cache_namespace = f"search:{request.top_k}"
+    cached_ids, query_embedding = lookup_cached_response(cache_namespace, query_embedding)
+    if cached_ids is not None:
+        logger.debug("♻️ Reusing cached selection for a similar query")
+        return ORJSONResponse({"query": user_query, "count": len(cached_ids), "recipe_ids": cached_ids})
 
     # -----------------------
     # Step 2: Retrieve top similar recipes from vector DB
     # -----------------------
     try:
-        similar_recipes = find_similar_recipes(user_query, top_k=request.top_k)
+        similar_recipes = await asyncio.to_thread(find_similar_by_embedding, query_embedding, top_k=request.top_k)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Vector search failed: {e}")
 
     if not similar_recipes:
         raise HTTPException(status_code=404, detail="No recipes found for this query")
 
-    print(f"✅ Retrieved {len(similar_recipes)} semantically similar recipes")
+    logger.debug("✅ Retrieved %d semantically similar recipes", len(similar_recipes))
 
     # -----------------------
     # Step 3: Prepare detailed recipe context for LLM
     # -----------------------
-    recipe_context = []
-    for r in similar_recipes:
-        full_recipe = get_recipe_by_id(RECIPES, r)
-        if full_recipe:
-            recipe_context.append({
-                "id": full_recipe.get("id_legacy") or full_recipe.get("id"),
-                "title": full_recipe.get("title"),
-                "description": full_recipe.get("description", ""),
-                "ingredients": [ing.get("name") for ing in full_recipe.get("ingredients", [])],
-                "utensils": full_recipe.get("utensils", []),
-                "tags": full_recipe.get("tags", []),
-            })
-
-    print(f"🧩 Prepared recipe context for {len(recipe_context)} recipes")
+    recipe_context = [RECIPE_CONTEXT_INDEX[r] for r in similar_recipes if r in RECIPE_CONTEXT_INDEX]
+
+    logger.debug("🧩 Prepared recipe context for %d recipes", len(recipe_context))
 
     # -----------------------
     # Step 4: Build LLM prompt
@@ -216,98 +365,73 @@ def search_recipes(request: RecipeSearchRequest):
     "{user_query}"
 
     You have access to {len(recipe_context)} relevant recipes:
-    {json.dumps(recipe_context, indent=2)}
+    {serialize_recipe_context(similar_recipes)}
 
     Select up to {request.top_k} recipes that best match the user's query.
-    Return ONLY a JSON list of recipe IDs ("id") in selection order.
+    Return ONLY a JSON object of the form {{"ids": [...]}} with the recipe IDs ("id") in selection order.
     """
 
-    print("🧠 Sending prompt to LLM...")
+    logger.debug("🧠 Sending prompt to LLM...")
 
     # -----------------------
     # Step 5: Query LLM
     # -----------------------
     try:
-        ai_response = query_nim(prompt)
-        selected_ids = json.loads(ai_response)
+        def parse(content: str) -> List[str]:
+            return known_recipe_ids(orjson.loads(content)["ids"], similar_recipes)
+
+        # Only a selection that parses to known IDs is kept in the NIM response cache
+        ai_response = await aquery_nim(prompt, max_tokens=ID_LIST_MAX_TOKENS, json_mode=True, validate=parse)
+        selected_ids = parse(ai_response)[:request.top_k]
+        cache_response(cache_namespace, query_embedding, selected_ids)
     except Exception as e:
-        print("⚠️ LLM response invalid, using fallback random selection.", e)
-        import random
-        selected_ids = [
-            get_recipe_by_id(RECIPES, r).get("id_legacy") or get_recipe_by_id(RECIPES, r).get("id")
-            for r in random.choices(similar_recipes, k=request.top_k)
-        ]
+        logger.warning("⚠️ LLM response invalid, using fallback random selection: %s", e)
+        # The vector search already returns recipe IDs: no lookup needed
+        selected_ids = sample_recipes(similar_recipes, request.top_k)
 
-    print(f"✅ Selected recipe IDs: {selected_ids}")
+    logger.debug("✅ Selected recipe IDs: %s", selected_ids)
 
     # -----------------------
     # Step 6: Return recipe IDs only
     # -----------------------
-    return {
+    return ORJSONResponse({
         "query": user_query,
         "count": len(selected_ids),
         "recipe_ids": selected_ids
-    }
+    })
 
-@app.post("/plan-meals", tags=["Meal Planner"])
-def plan_meals(request: MealRequest):
+async def retrieve_plan_candidates(request: MealRequest, query_embedding, top_k: int, ready: bool) -> List[str]:
     """
-    Generate a meal plan using embeddings + LLM reasoning (RAG pattern).
-    Steps:
-      1. Build semantic query from user preferences.
-      2. Retrieve top similar recipes from the vector DB.
-      3. Use these recipes as context for the LLM.
-      4. Prepare detailed recipe context.
-      5. Send structured prompt to NIM (LLM).
-      6. Parse LLM response (selected recipe IDs).
-      7. Match recipes by ID and prepare full recipe objects.
-      8. Attach images.
-      9. Structure plan by day.
-     10. Return final JSON response.
+    Recipe IDs offered to the LLM for a meal plan: vector search, with a keyword fallback.
+    While the embeddings are still loading (not `ready`) only the keyword match is used,
+    since the vector search would only see the part of the index built so far.
     """
-
-    # -----------------------
-    # Step 1: Build semantic query
-    # -----------------------
-    user_query = ", ".join(request.preferences) if request.preferences else "balanced weekly meals"
-    print(f"🔍 User query: {user_query}")
-
-    # -----------------------
-    # Step 2: Retrieve top similar recipes from vector DB
-    # -----------------------
-    try:
-        similar_recipes = find_similar_recipes(user_query, top_k=5)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Vector search failed: {e}")
+    similar_recipes = []
+    if ready:
+        try:
+            similar_recipes = await asyncio.to_thread(find_similar_by_embedding, query_embedding, top_k=top_k)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Vector search failed: {e}")
+
+    # 🩹 Fallback to keyword matching on title/cuisine/tags when the vector search returns nothing
+    if not similar_recipes and request.preferences:
+        filtered_recipes = filter_recipes_by_preferences(request.preferences)
+        logger.debug("🔎 Keyword fallback matched %d recipes", len(filtered_recipes))
+        similar_recipes = [r.get("id_legacy") or r.get("id") for r in filtered_recipes[:top_k]]
+
+    if not similar_recipes and not ready:
+        raise HTTPException(status_code=503, detail="Recipe embeddings are still loading, try again shortly")
 
     if not similar_recipes:
         raise HTTPException(status_code=404, detail="No similar recipes found")
 
-    print(f"✅ Retrieved {len(similar_recipes)} semantically similar recipes: {similar_recipes}")
-
-    # -----------------------
-    # Step 4: Prepare detailed recipe context
-    # -----------------------
-    recipe_context = []
-    for r in similar_recipes:
-        # Reuse helper function to get full recipe info
-        full_recipe = get_recipe_by_id(RECIPES, r)
-        if full_recipe:
-            context_entry = {
-                "id": full_recipe.get("id_legacy") or full_recipe.get("id"),
-                "title": full_recipe.get("title"),
-                "description": full_recipe.get("description", ""),
-                "ingredients": [ing.get("name") for ing in full_recipe.get("ingredients", [])],
-                "utensils": full_recipe.get("utensils", []),
-                "tags": full_recipe.get("tags", []),
-            }
-            recipe_context.append(context_entry)
-
-    print(f"🧩 Assembled recipe context for {len(recipe_context)} recipes")
+    logger.debug("✅ Retrieved %d semantically similar recipes", len(similar_recipes))
+    return similar_recipes
 
-    # -----------------------
-    # Step 5: Build AI prompt with detailed context
-    # -----------------------
+async def select_plan_recipes(request: MealRequest, user_query: str, similar_recipes: List[str], needed: int) -> List[str]:
+    """
+    Ask the NIM to pick the plan's recipes among the candidates; returns the known IDs it selected.
+    """
     prompt = f"""
     You are an AI meal planner for CulinAIry.
 
@@ -316,59 +440,148 @@ def plan_meals(request: MealRequest):
     - for {request.days} days
     - preferences: {user_query}
 
-    You have access to {len(recipe_context)} semantically relevant recipes:
-    {json.dumps(recipe_context, indent=2)}
+    You have access to {sum(r in RECIPE_CONTEXT_INDEX for r in similar_recipes)} semantically relevant recipes:
+    {serialize_recipe_context(similar_recipes)}
 
-    Select recipes that fit the user's preferences, ensuring variety, balance, and no repetition.
-    Return ONLY a JSON list of recipe IDs ("id") in selection order.
+    Select {needed} recipes that fit the user's preferences, ensuring variety, balance, and no repetition.
+    Return ONLY a JSON object of the form {{"ids": [...]}} with the recipe IDs ("id") in selection order.
     """
 
-    print("🧠 Sending prompt to NIM...")
+    logger.debug("🧠 Sending prompt to NIM...")
+    def parse(content: str) -> List[str]:
+        return known_recipe_ids(orjson.loads(content)["ids"], similar_recipes)
+
+    # Only a selection that parses to known IDs is kept in the NIM response cache
+    ai_response = await aquery_nim(
+        prompt, max_tokens=max(ID_LIST_MAX_TOKENS, needed * PLAN_TOKENS_PER_ID), json_mode=True, validate=parse
+    )
+    return parse(ai_response)
+
+@app.post(
+    "/plan-meals",
+    tags=["Meal Planner"],
+    summary="Generate a meal plan",
+    description="""
+    🧠 Generate a meal plan using available recipes.  
+    Filters recipes by preferences (optional), then organizes them by day and meal.
+    
+    Example:
+    ```json
+    {
+      "meals_per_day": 2,
+      "days": 3,
+      "preferences": ["low carb", "mexican"]
+    }
+    ```
+    """,
+     responses={
+        200: {
+            "description": "Meal plan successfully generated",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "summary": {
+                            "days": 3,
+                            "meals_per_day": 2,
+                            "preferences": ["low carb", "mexican"],
+                            "retrieved_recipes": 5
+                        },
+                        "plan": [
+                            {
+                                "day": 1,
+                                "meals": [
+                                    {"title": "Low-Carb Tex-Mex Beef Bowl", "cousine": "Tex-Mex"},
+                                    {"title": "Chicken Caesar Salad", "cousine": "American"}
+                                ]
+                            }
+                        ]
+                    }
+                }
+            },
+        }
+    },
+)
+async def plan_meals(request: MealRequest):
+    """
+    Generate a meal plan using embeddings + LLM reasoning (RAG pattern).
+    Steps:
+      1. Build semantic query from user preferences.
+      2. Retrieve top similar recipes from the vector DB.
+      3. Use these recipes as context for the LLM.
+      4. Prepare detailed recipe context.
+      5. Send structured prompt to NIM (LLM).
+      6. Parse LLM response (selected recipe IDs).
+      7. Match recipes by ID and prepare full recipe objects.
+      8. Attach images.
+      9. Structure plan by day.
+     10. Return final JSON response.
+    """
 
     # -----------------------
-    # Step 6: Query LLM (NIM)
+    # Step 1: Build semantic query
     # -----------------------
-    try:
-        ai_response = query_nim(prompt)
-        selected_ids = json.loads(ai_response)
-    except Exception as e:
-        print("⚠️ AI response invalid, using fallback random selection.", e)
-        import random
-        selected_ids = random.choices(similar_recipes, k=request.meals_per_day * request.days)
-
-    print("Selected recipe IDs:", selected_ids)
+    user_query = ", ".join(request.preferences) if request.preferences else "balanced weekly meals"
+    logger.debug("🔍 User query: %s", user_query)
+
+    # Retrieve enough candidates for every meal slot up front, so the plan needs no second lookup pass
+    needed = request.meals_per_day * request.days
+    top_k = max(PLAN_CONTEXT_SIZE, needed * 2)
+
+    # Embed the query once (batched with concurrent requests) for both the cache and the vector search
+    query_embedding = await embed_query(user_query)
+    # Read once: a plan built during warm-up is served but never cached, the cache has no TTL
+    ready = EMBEDDINGS_READY.is_set()
+
+    # Steps 2-6: a semantically similar request was already answered, so skip retrieval, the prompt
+    # and the LLM; otherwise retrieve candidates and let the NIM select among them
+    cache_namespace = f"plan-meals:{request.meals_per_day}x{request.days}"
+    cached, query_embedding = lookup_cached_response(cache_namespace, query_embedding)
+    if cached is not None:
+        logger.debug("♻️ Reusing cached NIM selection for a similar request")
+        selected_ids, similar_recipes = cached["ids"], cached["candidates"]
+    else:
+        similar_recipes = await retrieve_plan_candidates(request, query_embedding, top_k, ready)
+        try:
+            selected_ids = await select_plan_recipes(request, user_query, similar_recipes, needed)
+            if ready:
+                cache_response(cache_namespace, query_embedding, {"ids": selected_ids, "candidates": similar_recipes})
+        except Exception as e:
+            logger.warning("⚠️ AI response invalid, using fallback random selection: %s", e)
+            selected_ids = sample_recipes(similar_recipes, needed)
+
+    logger.debug("Selected recipe IDs: %s", selected_ids)
 
     # -----------------------
     # ✅ Step 7 – Match recipes by ID (reuse Step 4 logic)
     # -----------------------
     selected_recipes = []
     for recipe_id in selected_ids:
-        # Reuse get_recipe_by_id to locate recipes
-        recipe_data = get_recipe_by_id(RECIPES, recipe_id)
+        recipe_data = get_recipe_by_id(RECIPES_BY_ID, recipe_id)
         if recipe_data:
             selected_recipes.append(recipe_data)
         else:
-            print(f"⚠️ Warning: Recipe ID '{recipe_id}' not found in dataset.")
-
-    # 🩹 Fallback if LLM returned fewer recipes than needed
-    if len(selected_recipes) < request.meals_per_day * request.days:
-        import random
-        remaining_needed = request.meals_per_day * request.days - len(selected_recipes)
-        extra = random.choices(
-            [get_recipe_by_id(RECIPES, r) for r in similar_recipes if get_recipe_by_id(RECIPES, r)],
-            k=remaining_needed,
-        )
-        selected_recipes += extra
+            logger.warning("⚠️ Recipe ID '%s' not found in dataset.", recipe_id)
+
+    # 🩹 Pad from the retrieved candidates only if the LLM returned fewer recipes than needed,
+    # preferring candidates not already in the plan; repeats only once those run out
+    if len(selected_recipes) < needed:
+        remaining_needed = needed - len(selected_recipes)
+        candidates = [RECIPES_BY_ID[r] for r in similar_recipes if r in RECIPES_BY_ID]
+        chosen = {id(r) for r in selected_recipes}
+        unused = [r for r in candidates if id(r) not in chosen]
+        if len(unused) >= remaining_needed:
+            selected_recipes += random.sample(unused, remaining_needed)
+        elif candidates:
+            selected_recipes += unused + sample_recipes(candidates, remaining_needed - len(unused))
 
     # ✅ Just show the meals (concise output)
-    print(f"🍽️ Selected meals for the plan:")
-    for r in selected_recipes:
-        print(f" - {r.get('title')}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🍽️ Selected meals for the plan: %s", [r.get("title") for r in selected_recipes])
 
     # -----------------------
     # Step 8 – Attach images
     # -----------------------
-    selected_recipes_with_images = [attach_recipe_images(r) for r in selected_recipes]
+    selected_recipes_with_images = [attach_recipe_images_cached(r) for r in selected_recipes]
 
     # -----------------------
     # Step 9 – Structure plan by day
@@ -383,17 +596,17 @@ def plan_meals(request: MealRequest):
         })
 
     # -----------------------
-    # Step 10 – Return structured response
+    # Step 10 – Return structured response (as a Response, so FastAPI skips re-encoding the nested meals)
     # -----------------------
-    return {
+    return ORJSONResponse({
         "summary": {
             "days": request.days,
             "meals_per_day": request.meals_per_day,
             "preferences": request.preferences,
-            "retrieved_recipes": len(recipe_context),
+            "retrieved_recipes": sum(r in RECIPE_CONTEXT_INDEX for r in similar_recipes),
         },
         "plan": plan,
-    }
+    })
 
 # ------------------------------------------------------
 # 📖 Recipes Endpoints
@@ -403,45 +616,166 @@ def plan_meals(request: MealRequest):
 # List all recipes with optional limit
 # -------------------------------
 @app.get("/recipes", tags=["Recipes"])
-def list_recipes(limit: int = 10):
+def list_recipes(request: Request, limit: int = 10):
     """
     List recipes. Optional query parameter 'limit' to control number of recipes returned.
     Return a list of recipes with images attached.
     Example: /recipes?limit=5
     """
-    return [attach_recipe_images(r) for r in RECIPES[:limit]]
+    headers = {"ETag": f'"{RECIPES_ETAG}-{limit}"', "Cache-Control": RECIPE_CACHE_CONTROL}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    def generate():
+        # Stream the JSON array one pre-encoded recipe at a time instead of building it in memory first
+        yield b"["
+        for i, body in enumerate(RECIPE_JSON[:limit]):
+            if i:
+                yield b","
+            yield body
+        yield b"]"
+
+    return StreamingResponse(generate(), media_type="application/json", headers=headers)
 
 # -------------------------------
 # Fetch a single recipe by ID
 # -------------------------------
 @app.get("/recipe/{recipe_id}", tags=["Recipes"])
-def read_recipe(recipe_id: str):
+async def read_recipe(recipe_id: str, request: Request):
     """
     Fetch a single recipe by ID with images attached.
     Example: /recipe/cal-smart-tex-mex-beef-bowls
     """
 
     # Step 1: Find the recipe in the dataset
-    recipe = get_recipe_by_id(RECIPES, recipe_id)
-    
-    if not recipe:
+    position = RECIPE_POSITIONS.get(recipe_id)
+
+    if position is None:
         raise HTTPException(status_code=404, detail="Recipe not found")
 
-    # Step 2: Attach recipe images (AI-generated or stored)
-    recipe_with_images = attach_recipe_images(recipe)
+    # Step 2: Not modified since the client's copy -> no body at all
+    headers = {"ETag": RECIPE_ETAGS[position], "Cache-Control": RECIPE_CACHE_CONTROL}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # Step 3: Return the pre-encoded recipe (images attached)
+    return Response(content=RECIPE_JSON[position], media_type="application/json", headers=headers)
+
+
+# ------------------------------------------------------
+# 📦 Batch Endpoint
+# ------------------------------------------------------
+
+MAX_BATCH_REQUESTS = 20
+# Client headers copied from the batch request onto every sub-request
+# (a sub-request's own headers take precedence)
+FORWARDED_BATCH_HEADERS = ("accept", "accept-language", "authorization", "cookie", "if-none-match")
+
+class BatchSubRequest(BaseModel):
+    id: str = Field(..., description="Client-chosen ID, echoed back in the matching response")
+    method: str = Field("GET", description="HTTP method of the sub-request")
+    url: str = Field(..., description="Path (and optional query string), e.g. /recipes?limit=5")
+    body: Optional[Any] = Field(None, description="JSON body for POST sub-requests")
+    headers: Dict[str, str] = Field(default_factory=dict, description="Extra headers, e.g. If-None-Match")
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest] = Field(..., max_length=MAX_BATCH_REQUESTS)
+
+
+async def dispatch_sub_request(sub: BatchSubRequest, outer_headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Run one sub-request through the ASGI app in-process (no network hop, no extra HTTP parsing).
+    """
+    url = urlsplit(sub.url)
+    if url.path.rstrip("/") == "/batch":
+        return {"id": sub.id, "status": 400, "body": {"detail": "Nested batch requests are not allowed"}}
+
+    body = orjson.dumps(sub.body) if sub.body is not None else b""
+    headers = dict(outer_headers)
+    headers.update((k.lower(), v) for k, v in sub.headers.items())
+    headers["content-type"] = "application/json"
+    headers["content-length"] = str(len(body))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": sub.method.upper(),
+        "scheme": "http",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "root_path": "",
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        "client": None,
+        "server": None,
+    }
+
+    body_sent = False
+    response_complete = asyncio.Event()
+
+    async def receive():
+        # Deliver the body once, then behave like an idle client until the response is done
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    status = 500
+    etag = None
+    chunks = []
+
+    async def send(message):
+        nonlocal status, etag
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            etag = next((v.decode("latin-1") for k, v in message.get("headers", []) if k.lower() == b"etag"), None)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    try:
+        await app(scope, receive, send)
+    except Exception as e:
+        # Starlette re-raises unhandled errors after sending its 500: keep it to this sub-request
+        logger.error("❌ Batch sub-request %s %s failed: %s", sub.method, sub.url, e)
+        return {"id": sub.id, "status": 500, "body": {"detail": "Internal Server Error"}}
 
-    # Step 3: Return only the recipe information
-    return recipe_with_images
+    raw = b"".join(chunks)
+    try:
+        payload = orjson.loads(raw) if raw else None
+    except ValueError:
+        payload = raw.decode("utf-8", errors="replace")
+    result = {"id": sub.id, "status": status, "body": payload}
+    if etag is not None:
+        # Lets the client revalidate the sub-request later through its own If-None-Match
+        result["etag"] = etag
+    return result
+
+
+@app.post("/batch", tags=["Batch"])
+async def batch(request: BatchRequest, http_request: Request):
+    """
+    Execute several API calls in one request; sub-requests run concurrently.
+    Example:
+    ```json
+    {"requests": [{"id": "1", "url": "/recipe/cal-smart-tex-mex-beef-bowls"}, {"id": "2", "url": "/recipes?limit=5"}]}
+    ```
+    """
+    outer_headers = {k: v for k, v in http_request.headers.items() if k in FORWARDED_BATCH_HEADERS}
+    responses = await asyncio.gather(*[dispatch_sub_request(sub, outer_headers) for sub in request.requests])
+    return {"responses": responses}
 
 
 # -------------------
 # AI test endpoint
 # -------------------
 @app.get("/ai/test", tags=["AI"])
-def ai_test():
-    from utils.ai_agent import query_nim
+async def ai_test():
     prompt = "Give me 5 dinner ideas that are low-carb and Mexican inspired."
-    response = query_nim(prompt)
+    response = await aquery_nim(prompt)
     return {"prompt": prompt, "response": response}
 
 # ------------------------------------------------------
@@ -450,4 +784,12 @@ def ai_test():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)  # or any other port
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=5000,  # or any other port
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="auto",  # uvloop when installed (not available on Windows)
+        http="auto",  # httptools when installed
+        access_log=False,
+    )
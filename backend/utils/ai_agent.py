@@ -1,6 +1,15 @@
 import os
-import requests
-import json
+import logging
+import time
+import asyncio
+import hashlib
+import threading
+import httpx
+import orjson
+from collections import OrderedDict
+from utils.http_clients import make_session, LazyAsyncClient
+
+logger = logging.getLogger(__name__)
 
 # Default endpoint for local NIM
 # NIM_URL = os.getenv("NIM_URL", "http://localhost:8002/v1/chat/completions")
@@ -8,25 +17,167 @@ import json
 # Running AWS NIM endpoint (uncomment to use)
 NIM_URL = "http://ac848d2b77594435281c81d04a0230b6-51436228.us-east-1.elb.amazonaws.com:8000/v1/chat/completions"
 
-def query_nim(prompt: str, temperature: float = 0.7) -> str:
-    """
-    Sends a prompt to the locally running NVIDIA NIM (Llama-3.1 Nemotron Nano 8B).
-    """
+NIM_MODEL = "nvidia/llama-3.1-nemotron-nano-8b-v1"
+NIM_UNAVAILABLE = "AI service unavailable"
+
+# Seconds to wait for a connection / for the completion
+NIM_CONNECT_TIMEOUT = 5
+NIM_READ_TIMEOUT = 60
+
+# Completion budget for free-form answers / for {"ids": [...]} answers
+NIM_MAX_TOKENS = 300
+ID_LIST_MAX_TOKENS = 128
+
+# Shared sync session: keeps connections to the NIM alive between calls and retries transient errors
+_session = make_session(pool_maxsize=32, pool_connections=8)
+
+# Shared async client for the NIM endpoint, created on first use and closed on app shutdown
+_async_client = LazyAsyncClient(NIM_CONNECT_TIMEOUT, NIM_READ_TIMEOUT, max_connections=64, max_keepalive_connections=32)
+
+# In-flight NIM calls keyed like the response cache: concurrent identical requests share one round-trip
+_inflight = {}
+
+# Completed NIM responses: cache key -> (expiry time, content), least recently used first
+NIM_CACHE_SIZE = 1024
+NIM_CACHE_TTL = 3600  # seconds
+_response_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# Static parts of every request, built once
+_SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful AI assistant for meal planning and recipe generation."}
+_JSON_OBJECT_FORMAT = {"type": "json_object"}
+_HEADERS = {"Content-Type": "application/json"}
+
+
+def _build_payload(prompt: str, temperature: float, max_tokens: int, json_mode: bool) -> bytes:
     payload = {
-        "model": "nvidia/llama-3.1-nemotron-nano-8b-v1",
-        "messages": [
-            {"role": "system", "content": "You are a helpful AI assistant for meal planning and recipe generation."},
-            {"role": "user", "content": prompt}
-        ],
+        "model": NIM_MODEL,
+        "messages": [_SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
         "temperature": temperature,
-        "max_tokens": 300
+        "max_tokens": max_tokens
     }
+    if json_mode:
+        # Constrained decoding: the model can only emit a JSON object and stops at its closing brace
+        payload["response_format"] = _JSON_OBJECT_FORMAT
+    return orjson.dumps(payload)
+
+
+def _extract_content(data: dict) -> str:
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+
+
+def _cache_key(prompt: str, temperature: float, max_tokens: int, json_mode: bool) -> str:
+    # Whitespace-insensitive prompt, temperature bucketed to one decimal
+    key = {"p": " ".join(prompt.split()), "t": round(temperature, 1), "n": max_tokens, "j": json_mode, "model": NIM_MODEL}
+    return hashlib.sha256(orjson.dumps(key, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def _cache_get(key: str):
+    with _cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, content = entry
+        if expires_at < time.monotonic():
+            del _response_cache[key]
+            return None
+        _response_cache.move_to_end(key)
+        return content
 
+
+def _is_cacheable(content: str, json_mode: bool, validate) -> bool:
+    """
+    Only answers a caller could use are cached: never errors or empty answers, in JSON mode only
+    an object with an "ids" list, and only what the caller's optional `validate` accepts.
+    """
+    if not content or content == NIM_UNAVAILABLE:
+        return False
     try:
-        response = requests.post(NIM_URL, json=payload)
+        if json_mode:
+            data = orjson.loads(content)
+            if not isinstance(data, dict) or not isinstance(data.get("ids"), list):
+                return False
+        return validate is None or bool(validate(content))
+    except Exception:
+        return False
+
+
+def _cache_put(key: str, content: str, json_mode: bool, validate=None):
+    if not _is_cacheable(content, json_mode, validate):
+        return
+    with _cache_lock:
+        _response_cache[key] = (time.monotonic() + NIM_CACHE_TTL, content)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > NIM_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+def query_nim(prompt: str, temperature: float = 0.7, max_tokens: int = NIM_MAX_TOKENS, json_mode: bool = False, validate=None) -> str:
+    """
+    Sends a prompt to the locally running NVIDIA NIM (Llama-3.1 Nemotron Nano 8B).
+    With json_mode the answer is constrained to a single JSON object.
+    Usable responses are cached for NIM_CACHE_TTL seconds, keyed by prompt and generation settings;
+    `validate(content)` can reject an answer (return False or raise) so it is never replayed.
+    """
+    key = _cache_key(prompt, temperature, max_tokens, json_mode)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    payload = _build_payload(prompt, temperature, max_tokens, json_mode)
+
+    try:
+        response = _session.post(NIM_URL, data=payload, headers=_HEADERS, timeout=(NIM_CONNECT_TIMEOUT, NIM_READ_TIMEOUT))
         response.raise_for_status()
-        data = response.json()
-        return data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+        content = _extract_content(orjson.loads(response.content))
+        _cache_put(key, content, json_mode, validate)
+        return content
     except Exception as e:
-        print(f"❌ Error querying NIM: {e}")
-        return "AI service unavailable"
\ No newline at end of file
+        logger.error("❌ Error querying NIM: %s", e)
+        return NIM_UNAVAILABLE
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Return the shared async HTTP client, creating it if needed.
+    """
+    return _async_client.get()
+
+
+async def close_async_client():
+    """
+    Close the shared async HTTP client (called on app shutdown).
+    """
+    await _async_client.aclose()
+
+
+async def _apost_nim(payload: bytes, key: str, json_mode: bool, validate) -> str:
+    try:
+        response = await get_async_client().post(NIM_URL, content=payload, headers=_HEADERS)
+        response.raise_for_status()
+        content = _extract_content(orjson.loads(response.content))
+        _cache_put(key, content, json_mode, validate)
+        return content
+    except Exception as e:
+        logger.error("❌ Error querying NIM: %s", e)
+        return NIM_UNAVAILABLE
+
+
+async def aquery_nim(prompt: str, temperature: float = 0.7, max_tokens: int = NIM_MAX_TOKENS, json_mode: bool = False, validate=None) -> str:
+    """
+    Async version of query_nim: awaits the NIM round-trip instead of blocking a worker thread.
+    Identical prompts issued while a call is in flight wait for that call instead of sending their own.
+    """
+    key = _cache_key(prompt, temperature, max_tokens, json_mode)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_apost_nim(_build_payload(prompt, temperature, max_tokens, json_mode), key, json_mode, validate))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the call for everyone waiting on it
+    return await asyncio.shield(task)
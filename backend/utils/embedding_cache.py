@@ -0,0 +1,61 @@
+import sqlite3
+import hashlib
+import logging
+import numpy as np
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# On-disk store of embeddings by content: re-indexing only calls the NIM for new or edited recipe texts
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite3"
+
+
+def _key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _connect(path: str):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+    return conn
+
+
+def get_cached_embeddings(model: str, texts: list, path: str = EMBEDDING_CACHE_FILE) -> dict:
+    """
+    Return {position in texts: float32 embedding} for every text already embedded with this model.
+    """
+    keys = [_key(model, t) for t in texts]
+    positions = {}
+    for i, key in enumerate(keys):
+        positions.setdefault(key, []).append(i)
+
+    found = {}
+    try:
+        with closing(_connect(path)) as conn:
+            unique = list(positions)
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    for i in positions[key]:
+                        found[i] = vector
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Embedding cache unreadable, re-embedding all texts: %s", e)
+        return {}
+    return found
+
+
+def cache_embeddings(model: str, texts: list, embs, path: str = EMBEDDING_CACHE_FILE):
+    """
+    Store the embeddings of texts computed with this model.
+    """
+    rows = [(_key(model, t), np.asarray(e, dtype=np.float32).tobytes()) for t, e in zip(texts, embs)]
+    try:
+        with closing(_connect(path)) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Could not write the embedding cache: %s", e)
@@ -1,31 +1,325 @@
-import requests
+import os
+import logging
+import asyncio
+import orjson
 import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.http_clients import make_session, LazyAsyncClient
+from utils.embedding_cache import get_cached_embeddings, cache_embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock
+    fcntl = None
+
+try:
+    import faiss  # optional: pip install faiss-cpu
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
 
 # EMBEDDING_NIM_URL = "http://localhost:8001/v1/embeddings"  # your embeddings NIM
 
 EMBEDDING_NIM_URL = "http://ac848d2b98723443712c81d04a0230b7-09345228.us-east-1.elb.amazonaws.com:8000/v1/embeddings"
+EMBEDDING_MODEL = "nvidia/llama-3.2-nv-embedqa-1b-v2"
+
+# Seconds to wait for a connection / for the embeddings
+EMBEDDING_TIMEOUT = (5, 60)
+_HEADERS = {"Content-Type": "application/json"}
+
+# Shared session: index builds and query batches reuse pooled keep-alive connections to the NIM
+_session = make_session(pool_maxsize=16)
+
+# Shared async client for query embeddings, created on first use and closed on app shutdown
+_async_client = LazyAsyncClient(*EMBEDDING_TIMEOUT, max_connections=100, max_keepalive_connections=20)
+
+# Persisted copy of the index, reused across restarts and shared between workers via mmap
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDING_IDS_FILE = "embedding_ids.json"
+EMBEDDING_LOCK_FILE = "embeddings.lock"
+
+# In-memory index: one L2-normalized float32 row per recipe, so cosine similarity is a single matmul
+_ids = []          # recipe id of each matrix row
+_id_rows = {}      # recipe id -> matrix row
+# Storage type of the index: "float16" halves its RAM / file size (for large catalogs) at the cost of
+# slower scoring, since numpy has no float16 BLAS and rows are upcast to float32 a tile at a time
+EMBEDDING_DTYPE = np.dtype(os.getenv("EMBEDDING_DTYPE", "float32"))
+if EMBEDDING_DTYPE not in (np.float16, np.float32):
+    # Integer types would truncate the unit-length rows to zeros and every score to 0
+    raise ValueError(f"EMBEDDING_DTYPE must be float16 or float32, got {EMBEDDING_DTYPE}")
+SCORE_TILE_ROWS = 512
+_matrix = np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+_buffer = None  # preallocated rows behind _matrix while the index is built in memory
 
-# In-memory storage for demo purposes
-embedding_index = {}
+# "float32" scores every recipe exactly; "binary" shortlists candidates by Hamming distance
+# between packed sign bits (32x less memory traffic) and rescores only the shortlist exactly;
+# "faiss" searches a FAISS inner-product index (falls back to "float32" if faiss isn't installed)
+EMBEDDING_SEARCH_MODE = os.getenv("EMBEDDING_SEARCH_MODE", "float32")
+BINARY_RESCORE_FACTOR = 8
+_binary_codes = None  # packed sign bits of _matrix, rebuilt lazily after the index changes
+
+# Above this many recipes the FAISS index is inverted-file (approximate) instead of flat (exact)
+FAISS_IVF_MIN_SIZE = 100_000
+FAISS_NPROBE = 16
+# FAISS_INDEX=hnsw uses an HNSW graph (approximate, no training step) at every catalog size
+FAISS_INDEX = os.getenv("FAISS_INDEX", "auto")
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_SEARCH = 64
+_faiss_index = None  # FAISS index over _matrix, rebuilt lazily after the index changes
 
 def get_embedding(text: str):
     """
     Query the Retrieval Embedding NIM to get embeddings for a text.
+    Returns a float32 vector, or None if the call fails.
     """
-    payload = {
-        "input": [text],
-        "model": "nvidia/llama-3.2-nv-embedqa-1b-v2",
-        "input_type": "query"
-    }
+    embs = get_embeddings_batch([text])
+    return None if embs is None else embs[0]
+
+
+# Query micro-batching: concurrent requests share one embeddings NIM call.
+# EMBED_FLUSH_MS=0 sends at once, batching only what queued up while the previous call was being built
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_FLUSH_MS = float(os.getenv("EMBED_FLUSH_MS", "10"))
+
+
+class EmbedBatcher:
+    """
+    Collects texts embedded by concurrent requests for up to EMBED_FLUSH_MS
+    (or until EMBED_BATCH_MAX are queued) and embeds them with one NIM call.
+    Batches are sent without waiting for the previous one to come back.
+    """
+
+    def __init__(self, max_size: int = EMBED_BATCH_MAX, max_delay: float = EMBED_FLUSH_MS / 1000):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+        self._loop = None
+        self._flushes = set()
+
+    async def embed(self, text: str):
+        """
+        Return the embedding of one text (None if the NIM call fails).
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._flushes = set()
+            self._task = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list):
+        # Identical texts in one window are embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embs = await aget_embeddings_batch(texts)
+        except Exception as e:
+            logger.error("❌ Error in embedding batch: %s", e)
+            embs = None
+        by_text = {}
+        if embs is not None:
+            # Normalize the whole batch at once; zero or non-finite vectors resolve to None
+            norms_sq = np.einsum("ij,ij->i", embs, embs)
+            valid = np.isfinite(norms_sq) & (norms_sq >= MIN_NORM_SQ)
+            units = embs / np.sqrt(np.where(valid, norms_sq, 1))[:, None]
+            by_text = {text: unit if ok else None for text, unit, ok in zip(texts, units, valid)}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text.get(text))
+
+    async def close(self):
+        """
+        Stop the background tasks (called on app shutdown).
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        for flush in list(self._flushes):
+            flush.cancel()
+        self._task = None
+
+
+_query_batcher = EmbedBatcher()
+
+# Most recently used query embeddings (text -> read-only unit vector): repeated queries skip the NIM
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+_query_embeddings = OrderedDict()
+
+
+async def embed_query(text: str):
+    """
+    Async get_embedding: the text is embedded together with those of concurrent requests.
+    Returns a unit-length float32 vector (None if the call fails or the embedding is zero).
+    """
+    emb = _query_embeddings.get(text)
+    if emb is not None:
+        _query_embeddings.move_to_end(text)
+        return emb
+    emb = await _query_batcher.embed(text)
+    if emb is not None:
+        # A copy, so the cache doesn't keep the whole batch's matrix alive behind a row view;
+        # shared by every later caller of the same query, so make sure none of them can modify it
+        emb = emb.copy()
+        emb.flags.writeable = False
+        _query_embeddings[text] = emb
+        if len(_query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embeddings.popitem(last=False)
+    return emb
+
+
+async def close_embed_batcher():
+    """
+    Stop the query batcher and close its HTTP client (called on app shutdown).
+    """
+    await _query_batcher.close()
+    await _async_client.aclose()
+
+
+def get_embeddings_batch(texts: list):
+    """
+    Query the Retrieval Embedding NIM once for a list of texts.
+    Returns a float32 (len(texts), dim) matrix in input order, or None if the call fails.
+    """
+    if not texts:
+        return None
     try:
-        response = requests.post(EMBEDDING_NIM_URL, json=payload)
+        response = _session.post(EMBEDDING_NIM_URL, data=_batch_payload(texts), headers=_HEADERS, timeout=EMBEDDING_TIMEOUT)
         response.raise_for_status()
-        embedding = response.json()["data"][0]["embedding"]
-        return np.array(embedding)
+        return _parse_batch(response.content, len(texts))
     except Exception as e:
-        print("Error calling embeddings NIM:", e)
+        logger.error("❌ Error calling embeddings NIM: %s", e)
         return None
-    
+
+
+async def aget_embeddings_batch(texts: list):
+    """
+    Async version of get_embeddings_batch: awaits the NIM instead of blocking a thread.
+    """
+    if not texts:
+        return None
+    try:
+        response = await _async_client.get().post(EMBEDDING_NIM_URL, content=_batch_payload(texts), headers=_HEADERS)
+        response.raise_for_status()
+        return _parse_batch(response.content, len(texts))
+    except Exception as e:
+        logger.error("❌ Error calling embeddings NIM: %s", e)
+        return None
+
+
+def _batch_payload(texts: list) -> bytes:
+    return orjson.dumps({
+        "input": texts,
+        "model": EMBEDDING_MODEL,
+        "input_type": "query"
+    })
+
+
+def _parse_batch(content: bytes, expected: int):
+    # orjson parses the float-heavy body several times faster than the stdlib json
+    data = sorted(orjson.loads(content)["data"], key=lambda d: d.get("index", 0))
+    # A short answer would shift every embedding onto the wrong recipe id
+    if len(data) != expected:
+        raise ValueError(f"expected {expected} embeddings, got {len(data)}")
+    # Straight to float32: no intermediate float64 array
+    return np.array([d["embedding"] for d in data], dtype=np.float32)
+
+
+# Squared norms below this (or NaN / inf, from a malformed NIM response) mark an unusable embedding
+MIN_NORM_SQ = 1e-12
+
+
+def _normalize(emb):
+    """
+    Return the embedding as a unit-length float32 vector, or None for a zero or non-finite vector.
+    """
+    emb = np.asarray(emb, dtype=np.float32)
+    # vdot skips linalg.norm's dispatch overhead on a single vector
+    norm_sq = np.vdot(emb, emb)
+    if not np.isfinite(norm_sq) or norm_sq < MIN_NORM_SQ:
+        return None
+    return emb / np.sqrt(norm_sq)
+
+
+def _store_embeddings(recipe_ids: list, embs: list):
+    """
+    Normalize embeddings and write them into the index, replacing rows of known recipe ids.
+    Returns the number of recipes stored.
+    """
+    global _matrix, _binary_codes, _faiss_index
+    _binary_codes = None
+    _faiss_index = None
+    stored = 0
+    for recipe_id, emb in zip(recipe_ids, embs):
+        emb = _normalize(emb)
+        if emb is None:
+            continue
+        stored += 1
+        row = _id_rows.get(recipe_id)
+        if row is None:
+            _reserve(1, len(emb))
+            row = len(_matrix)
+            _buffer[row] = emb
+            _id_rows[recipe_id] = row
+            _ids.append(recipe_id)
+            # Grow the visible view last, so a concurrent search never sees a row without an id
+            _matrix = _buffer[:row + 1]
+        else:
+            if not _matrix.flags.writeable:
+                _reserve(0, len(emb))
+            _matrix[row] = emb
+    # Again once every row is written: a search running meanwhile may have rebuilt them from
+    # the rows stored so far, which would leave the later rows unsearchable
+    _binary_codes = None
+    _faiss_index = None
+    return stored
+
+
+def _reserve(extra: int, dim: int):
+    """
+    Make room for `extra` more rows after _matrix, in a buffer we own and can write to.
+    Capacity doubles when it runs out, so adding rows costs amortized O(1) instead of a full copy each time.
+    """
+    global _matrix, _buffer
+    size = len(_matrix)
+    if _buffer is not None and _matrix.base is _buffer and size + extra <= len(_buffer):
+        return
+    owned = _buffer is not None and _matrix.base is _buffer
+    capacity = max(16, size + extra, 2 * (len(_buffer) if owned else size))
+    buffer = np.empty((capacity, dim), dtype=EMBEDDING_DTYPE)
+    if size:
+        buffer[:size] = _matrix
+    _buffer = buffer
+    _matrix = _buffer[:size]
+
 
 def add_recipe_embedding(recipe_id: str, text: str):
     """
@@ -33,25 +327,203 @@ def add_recipe_embedding(recipe_id: str, text: str):
     """
     emb = get_embedding(text)
     if emb is not None:
-        embedding_index[recipe_id] = emb
-        # print("Embedding index contents:", embedding_index)
-        return True
-    
+        return _store_embeddings([recipe_id], [emb]) == 1
+
     return False
 
 
+# Index builds keep this many batch calls to the embeddings NIM in flight
+EMBED_BUILD_WORKERS = 4
+
+
+def add_recipe_embeddings_batch(recipe_ids: list, texts: list, batch_size: int = 64, stop=None):
+    """
+    Add many recipes to the embedding index, one NIM call per `batch_size` texts,
+    EMBED_BUILD_WORKERS calls at a time.
+    Texts embedded by an earlier build are read from the on-disk embedding cache instead,
+    so only new or edited recipes reach the NIM.
+    Texts are grouped by length so each batch pads its inputs to a similar size.
+    Once the optional `stop` event is set (app shutdown), batches not yet sent are dropped.
+    Returns the number of recipes indexed.
+    """
+    cached = get_cached_embeddings(EMBEDDING_MODEL, texts)
+    added = 0
+    if cached:
+        positions = sorted(cached)
+        added += _store_embeddings([recipe_ids[i] for i in positions], [cached[i] for i in positions])
+
+    order = sorted((i for i in range(len(texts)) if i not in cached), key=lambda i: len(texts[i]))
+    chunks = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    with ThreadPoolExecutor(max_workers=EMBED_BUILD_WORKERS) as pool:
+        futures = {pool.submit(get_embeddings_batch, [texts[i] for i in chunk]): chunk for chunk in chunks}
+        # Results are stored from this thread only, as each call completes
+        for future in as_completed(futures):
+            if stop is not None and stop.is_set():
+                # Only the calls already in flight are waited for on leaving the pool
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+            chunk, embs = futures[future], future.result()
+            if embs is None:
+                continue
+            cache_embeddings(EMBEDDING_MODEL, [texts[i] for i in chunk], embs)
+            added += _store_embeddings([recipe_ids[i] for i in chunk], embs)
+    return added
+
+
+def save_embedding_index(source_hash: str, emb_path: str = EMBEDDINGS_FILE, ids_path: str = EMBEDDING_IDS_FILE):
+    """
+    Persist the embedding index to disk, tagged with the hash of the recipe data it was built from.
+    """
+    if not _ids:
+        return False
+
+    # Write to temp files and rename, so a worker mapping the index never sees a half-written file
+    with open(emb_path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(_matrix, dtype=EMBEDDING_DTYPE))
+    os.replace(emb_path + ".tmp", emb_path)
+    with open(ids_path + ".tmp", "wb") as f:
+        f.write(orjson.dumps({"source_hash": source_hash, "model": EMBEDDING_MODEL, "normalized": True, "ids": _ids}))
+    os.replace(ids_path + ".tmp", ids_path)
+    return True
+
+
+@contextmanager
+def embedding_build_lock(lock_path: str = EMBEDDING_LOCK_FILE):
+    """
+    Hold an exclusive cross-process lock while building the index, so that with several
+    workers only the first one calls the embeddings NIM and the others load its result.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_embedding_index(source_hash: str, emb_path: str = EMBEDDINGS_FILE, ids_path: str = EMBEDDING_IDS_FILE):
+    """
+    Memory-map a persisted embedding index if it was built from the same recipe data.
+    Returns True if the index was loaded.
+    """
+    global _matrix, _binary_codes, _faiss_index
+    try:
+        with open(ids_path, "rb") as f:
+            meta = orjson.loads(f.read())
+        # Vectors from another model live in another space: stale even if the recipes are unchanged
+        if meta.get("source_hash") != source_hash or meta.get("model") != EMBEDDING_MODEL or not meta.get("normalized"):
+            return False
+        matrix = np.load(emb_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return False
+
+    if matrix.ndim != 2 or len(matrix) != len(meta["ids"]):
+        return False
+
+    if matrix.dtype != EMBEDDING_DTYPE:
+        # Saved under another EMBEDDING_DTYPE: convert in memory (not shared) rather than re-embed
+        matrix = matrix.astype(EMBEDDING_DTYPE)
+    _matrix = matrix
+    _binary_codes = None
+    _faiss_index = None
+    _ids[:] = meta["ids"]
+    _id_rows.clear()
+    _id_rows.update((rid, row) for row, rid in enumerate(_ids))
+    if EMBEDDING_SEARCH_MODE == "faiss" and faiss is not None and len(_ids):
+        # Build now, at startup, rather than inside the first search request
+        _get_faiss_index()
+    return True
+
+
+def _top_k(scores, k: int):
+    """
+    Return the positions of the k highest scores, best first.
+    """
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _scores(matrix, query_emb):
+    """
+    Dot product of every row with the query; float16 rows are upcast one tile at a time.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query_emb
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_TILE_ROWS):
+        tile = matrix[start:start + SCORE_TILE_ROWS]
+        scores[start:start + len(tile)] = tile.astype(np.float32) @ query_emb
+    return scores
+
+
+def _binary_shortlist(query_emb, n: int):
+    """
+    Return the n rows whose sign bits are closest (Hamming distance) to the query's.
+    """
+    global _binary_codes
+    if _binary_codes is None:
+        _binary_codes = np.packbits(_matrix > 0, axis=1)
+    query_code = np.packbits(query_emb > 0)
+    distances = np.bitwise_count(_binary_codes ^ query_code).sum(axis=1, dtype=np.int32)
+    return np.argpartition(distances, n - 1)[:n]
+
+
+def _get_faiss_index():
+    """
+    Return the FAISS inner-product index over the embedding matrix, building it if needed.
+    Rows are unit length, so inner product is cosine similarity.
+    """
+    global _faiss_index
+    if _faiss_index is None:
+        vectors = np.ascontiguousarray(_matrix, dtype=np.float32)
+        n, dim = vectors.shape
+        if FAISS_INDEX == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+        elif n >= FAISS_IVF_MIN_SIZE:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, int(np.sqrt(n)), faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = FAISS_NPROBE
+        else:
+            index = faiss.IndexFlatIP(dim)
+        index.add(vectors)
+        _faiss_index = index
+    return _faiss_index
+
+
 def find_similar_recipes(query_text: str, top_k: int = 3):
     """
     Find the most similar recipes based on cosine similarity.
     """
     query_emb = get_embedding(query_text)
-    if query_emb is None or not embedding_index:
-        return []
+    return find_similar_by_embedding(None if query_emb is None else _normalize(query_emb), top_k)
+
 
-    similarities = []
-    for rid, emb in embedding_index.items():
-        sim = np.dot(query_emb, emb) / (np.linalg.norm(query_emb) * np.linalg.norm(emb))
-        similarities.append((rid, sim))
+def find_similar_by_embedding(query_emb, top_k: int = 3):
+    """
+    Same as find_similar_recipes, for a query already embedded and normalized (see embed_query).
+    Stored rows are unit length too, so every cosine similarity is a plain dot product.
+    """
+    if query_emb is None or not _ids or top_k <= 0:
+        return []
 
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return [rid for rid, _ in similarities[:top_k]]
+    # _matrix is a leading slice of a C-contiguous buffer, so only the query can knock the
+    # product off the float32 BLAS sgemv path (a float64 or strided vector is 2-15x slower)
+    query_emb = np.ascontiguousarray(query_emb, dtype=np.float32)
+    k = min(top_k, len(_matrix))
+    shortlist_size = k * BINARY_RESCORE_FACTOR
+    if EMBEDDING_SEARCH_MODE == "faiss" and faiss is not None:
+        _, found = _get_faiss_index().search(query_emb.reshape(1, -1), k)
+        # IVF may find fewer than k neighbours; missing slots are -1
+        return [_ids[i] for i in found[0] if i >= 0]
+    if EMBEDDING_SEARCH_MODE == "binary" and len(_ids) > shortlist_size:
+        candidates = _binary_shortlist(query_emb, shortlist_size)
+        top = candidates[_top_k(_scores(_matrix[candidates], query_emb), k)]
+    else:
+        # Rows are unit length, so one matrix-vector product gives every cosine similarity
+        top = _top_k(_scores(_matrix, query_emb), k)
+    return [_ids[i] for i in top]
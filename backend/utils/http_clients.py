@@ -0,0 +1,42 @@
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Transient NIM errors retried by the sync sessions (POST included: NIM calls have no side effects)
+NIM_RETRY = Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504], allowed_methods=["POST"])
+
+
+def make_session(pool_maxsize: int, pool_connections: int = 10) -> requests.Session:
+    """
+    Return a requests session that keeps up to pool_maxsize connections per NIM host alive
+    and retries transient errors.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=NIM_RETRY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+class LazyAsyncClient:
+    """
+    An httpx.AsyncClient created on first use (inside the running event loop) and recreated
+    if it was closed; close it with aclose() on app shutdown.
+    """
+
+    def __init__(self, connect_timeout: float, read_timeout: float, max_connections: int, max_keepalive_connections: int):
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+        self._client = None
+
+    def get(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,16 +1,30 @@
 import os
-import json
-from typing import List, Dict, Any
+import logging
+import re
+import mmap
+import hashlib
+import orjson
+from typing import List, Dict, Any, Set
+
+logger = logging.getLogger(__name__)
 
 # Base path for images (relative to backend folder)
 IMAGE_BASE_PATH = "images"
 BASE_URL = "http://localhost:8080"  # used for FastAPI docs and frontend previews
 
+# Recipes with image URLs attached, keyed by recipe ID (recipes and images are static at runtime)
+_IMAGE_CACHE: Dict[str, Dict[str, Any]] = {}
+
 def load_recipes_from_file(file_path: str) -> List[Dict[str, Any]]:
     """Load all recipes from a single JSON file."""
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # Parse straight from a read-only memory map: no Python-level copy of the file
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise orjson.JSONDecodeError("Empty file", "", 0)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    data = orjson.loads(view)
 
         # Handle both possible structures: a list or a dict containing 'recipes'
         if isinstance(data, dict) and "recipes" in data:
@@ -21,48 +35,155 @@ def load_recipes_from_file(file_path: str) -> List[Dict[str, Any]]:
             raise ValueError("Invalid JSON format: must be a list or contain a 'recipes' key.")
 
     except FileNotFoundError:
-        print(f"❌ File not found: {file_path}")
+        logger.error("❌ File not found: %s", file_path)
         return []
-    except json.JSONDecodeError:
-        print(f"❌ Error decoding JSON in {file_path}")
+    except orjson.JSONDecodeError:
+        logger.error("❌ Error decoding JSON in %s", file_path)
         return []
 
 
-def get_recipe_by_id(recipes: list, recipe_id: str) -> dict:
+def get_file_hash(file_path: str) -> str:
+    """Return the sha256 hex digest of a file, or an empty string if it can't be read."""
+    try:
+        # Hash in chunks rather than reading the whole file into memory
+        with open(file_path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except OSError:
+        return ""
+
+
+def build_recipe_index(recipes: list) -> Dict[str, Dict[str, Any]]:
+    """
+    Map every 'id' and 'id_legacy' to its recipe, for O(1) lookups.
+    When IDs collide the first recipe in the list wins, like a linear scan would.
+    """
+    index: Dict[str, Dict[str, Any]] = {}
+    for recipe in recipes:
+        for key in (recipe.get("id_legacy"), recipe.get("id")):
+            if key:
+                index.setdefault(key, recipe)
+    return index
+
+
+def get_recipe_by_id(recipes, recipe_id: str) -> dict:
     """
     Find a recipe by its 'id_legacy' or 'id' field.
+    Accepts either an index from build_recipe_index (O(1), use this on request paths)
+    or the recipe list (linear scan, for one-off scripts).
     Returns an empty dict if not found.
     """
+    if isinstance(recipes, dict):
+        try:
+            return recipes.get(recipe_id) or {}
+        except TypeError:  # unhashable ID, e.g. from a malformed LLM response
+            return {}
+
     for recipe in recipes:
         if recipe.get("id_legacy") == recipe_id or recipe.get("id") == recipe_id:
             return recipe
     return {}
 
 
-def attach_recipe_images(recipe: Dict[str, Any]) -> Dict[str, Any]:
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercased alphanumeric word tokens."""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def recipe_tag_names(recipe: Dict[str, Any]) -> List[str]:
+    """Tag names of a recipe (tags are plain strings or {"name": ...} objects)."""
+    return [t if isinstance(t, str) else t.get("name", "") for t in recipe.get("tags") or []]
+
+
+def build_search_blobs(recipes: list) -> List[str]:
+    """
+    Lowercased title, cuisine and tag names of each recipe, NUL-separated,
+    for substring matching of preferences the token index can't answer.
+    """
+    return [
+        "\0".join([recipe.get("title", ""), recipe.get("cousine") or "", *recipe_tag_names(recipe)]).lower()
+        for recipe in recipes
+    ]
+
+
+def build_token_index(recipes: list) -> Dict[str, Set[int]]:
+    """
+    Build an inverted index from title/cuisine/tag tokens to recipe positions.
+    Adjacent word pairs are indexed too (e.g. "low carb") so phrases can be matched,
+    as are whole cuisine and tag strings (e.g. "tex-mex").
+    """
+    index: Dict[str, Set[int]] = {}
+    for i, recipe in enumerate(recipes):
+        tags = recipe_tag_names(recipe)
+        cuisine = recipe.get("cousine") or ""
+        for field in [recipe.get("title", ""), cuisine, *tags]:
+            tokens = tokenize(field)
+            bigrams = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for token in tokens + bigrams:
+                index.setdefault(token, set()).add(i)
+        for whole in [cuisine, *tags]:
+            if whole.strip():
+                index.setdefault(whole.strip().lower(), set()).add(i)
+    return index
+
+
+def _bn(path: str) -> str:
+    """Basename of a '/'-separated image path (what os.path.basename does on POSIX, without its overhead)."""
+    return path.rpartition("/")[2]
+
+
+def attach_recipe_images(recipe: Dict[str, Any], copy: bool = True) -> Dict[str, Any]:
     """
     Attach full URLs for dish, cooking steps, and ingredient images.
     Uses FastAPI's /images static route for rendering in docs.
+    With copy=False the recipe itself is decorated instead of a shallow copy.
     """
-    recipe = recipe.copy()
+    if copy:
+        recipe = recipe.copy()
 
     # --- Dish Image ---
     dish_img = recipe.get("image_url")
     if dish_img:
-        recipe["dish_image_url"] = f"{BASE_URL}/images/dish/{os.path.basename(dish_img)}"
+        recipe["dish_image_url"] = f"{BASE_URL}/images/dish/{_bn(dish_img)}"
 
     # --- Step Images ---
     if "steps" in recipe:
         for idx, step in enumerate(recipe["steps"]):
             step_img = step.get("image")
             if step_img:
-                recipe["steps"][idx]["image_url"] = f"{BASE_URL}/images/cooking_step/{os.path.basename(step_img)}"
+                recipe["steps"][idx]["image_url"] = f"{BASE_URL}/images/cooking_step/{_bn(step_img)}"
 
     # --- Ingredient Images ---
     if "ingredients" in recipe:
         for idx, ing in enumerate(recipe["ingredients"]):
             ing_img = ing.get("image")
             if ing_img:
-                recipe["ingredients"][idx]["image_url"] = f"{BASE_URL}/images/ingredient/{os.path.basename(ing_img)}"
+                recipe["ingredients"][idx]["image_url"] = f"{BASE_URL}/images/ingredient/{_bn(ing_img)}"
 
     return recipe
+
+
+def attach_recipe_images_cached(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Same as attach_recipe_images, but builds each recipe's URLs only once.
+    The returned dict is shared between callers — copy it before mutating.
+    """
+    recipe_id = recipe.get("id_legacy") or recipe.get("id")
+    if not recipe_id:
+        return attach_recipe_images(recipe)
+
+    cached = _IMAGE_CACHE.get(recipe_id)
+    if cached is None:
+        cached = _IMAGE_CACHE[recipe_id] = attach_recipe_images(recipe)
+    return cached
+
+
+def precompute_recipe_images(recipes: list) -> None:
+    """
+    Attach image URLs to every loaded recipe in place and cache it, so no request pays for
+    building URLs and the process doesn't hold a second, decorated copy of each recipe.
+    """
+    for recipe in recipes:
+        recipe_id = recipe.get("id_legacy") or recipe.get("id")
+        attach_recipe_images(recipe, copy=False)
+        if recipe_id:
+            _IMAGE_CACHE.setdefault(recipe_id, recipe)
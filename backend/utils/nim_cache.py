@@ -0,0 +1,52 @@
+import threading
+import numpy as np
+
+# Cosine similarity above which two queries are treated as the same request
+SIMILARITY_THRESHOLD = 0.95
+# Max cached responses per namespace (oldest entries are evicted first)
+MAX_ENTRIES_PER_NAMESPACE = 256
+
+# In-memory storage: namespace -> (matrix of normalized query embeddings, one row per response; responses)
+_cache = {}
+_lock = threading.Lock()
+
+
+def lookup_cached_response(namespace: str, query_embedding):
+    """
+    Look up a response cached for a semantically similar query, already embedded and
+    normalized (see embed_query). The namespace must capture every exact parameter of the
+    request (e.g. number of days), only the query is compared by meaning.
+    Returns (response, query_embedding); response is None on a cache miss.
+    """
+    emb = query_embedding
+    if emb is None:
+        return None, None
+
+    with _lock:
+        matrix, responses = _cache.get(namespace, (None, ()))
+    if not responses:
+        return None, emb
+
+    # One matrix-vector product scores every cached query
+    sims = matrix @ emb
+    best = int(np.argmax(sims))
+    if sims[best] >= SIMILARITY_THRESHOLD:
+        return responses[best], emb
+    return None, emb
+
+
+def cache_response(namespace: str, query_embedding, response):
+    """
+    Store a response under the embedding returned by lookup_cached_response.
+    """
+    if query_embedding is None:
+        return
+    row = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    with _lock:
+        matrix, responses = _cache.get(namespace, (None, []))
+        # Build new objects rather than mutating, so readers holding the old pair stay consistent
+        matrix = row if matrix is None else np.vstack((matrix, row))
+        responses = responses + [response]
+        if len(responses) > MAX_ENTRIES_PER_NAMESPACE:
+            matrix, responses = matrix[1:], responses[1:]
+        _cache[namespace] = (matrix, responses)
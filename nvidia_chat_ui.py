@@ -2,7 +2,13 @@ import streamlit as st
 from openai import OpenAI
 
 # Connect to your local NIM endpoint
-client = OpenAI(base_url="http://localhost:8000/v1", api_key="none")
+@st.cache_resource
+def get_client():
+    # Streamlit re-runs this script on every message: share one client (and its connection pool)
+    return OpenAI(base_url="http://localhost:8000/v1", api_key="none")
+
+
+client = get_client()
 
 st.set_page_config(page_title="💬 NVIDIA Llama Chat", layout="wide")
 st.title("💬 Chat with NVIDIA Llama 3.1 (Local)")
@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 from backend.main import app
 
@@ -13,4 +14,262 @@ def test_health_check():
     """Simple health check"""
     response = client.get("/helth")
     assert response.status_code == 200
-    assert response.json() == {"status" : "ok"}
\ No newline at end of file
+    assert response.json() == {"status" : "ok"}
+
+def test_build_token_index():
+    """Token index maps words and adjacent word pairs to recipe positions"""
+    from utils.loader import build_token_index
+
+    recipes = [
+        {"title": "Low-Carb Tex-Mex Beef Bowl", "cousine": "Tex-Mex", "tags": ["Spicy"]},
+        {"title": "Chicken Caesar Salad", "cousine": "American", "tags": [{"name": "Quick Meals"}]},
+    ]
+    index = build_token_index(recipes)
+    assert index["low carb"] == {0}
+    assert index["chicken"] == {1}
+    assert index["american"] == {1}
+    assert index["tex-mex"] == {0}
+    assert index["spicy"] == {0}
+    assert index["quick meals"] == {1}
+    assert "carb tex" in index
+    assert "bowl tex" not in index
+
+
+def test_build_search_blobs():
+    """Substring-search blobs cover title, cuisine and tag names"""
+    from utils.loader import build_search_blobs
+
+    blobs = build_search_blobs([
+        {"title": "Chicken Caesar Salad", "cousine": "American", "tags": ["Spicy", {"name": "Quick Meals"}]},
+        {"title": "Plain Rice", "cousine": None},
+    ])
+    assert "quick mea" in blobs[0] and "spicy" in blobs[0] and "american" in blobs[0]
+    assert blobs[1] == "plain rice\0"
+
+
+def test_batch():
+    """Batch endpoint runs sub-requests in-process and preserves their ids"""
+    response = client.post("/batch", json={"requests": [
+        {"id": "a", "url": "/"},
+        {"id": "b", "url": "/health"},
+        {"id": "c", "url": "/recipe/does-not-exist"},
+        {"id": "d", "url": "/batch", "method": "POST"},
+    ]})
+    assert response.status_code == 200
+    responses = {r["id"]: r for r in response.json()["responses"]}
+    assert responses["a"]["status"] == 200
+    assert "Welcome" in responses["a"]["body"]["message"]
+    assert responses["b"]["body"] == {"status": "ok"}
+    assert responses["c"]["status"] == 404
+    assert responses["d"]["status"] == 400
+
+
+def test_batch_isolates_failures_and_forwards_headers():
+    """A sub-request that raises only fails its own entry; If-None-Match reaches sub-requests"""
+    def boom():
+        raise RuntimeError("boom")
+    app.add_api_route("/_test-boom", boom)
+    boom_route = app.router.routes[-1]
+
+    etag = client.get("/recipes?limit=1").headers["etag"]
+    try:
+        response = client.post("/batch", json={"requests": [
+            {"id": "ok", "url": "/recipes?limit=1"},
+            {"id": "boom", "url": "/_test-boom"},
+            {"id": "cached", "url": "/recipes?limit=1", "headers": {"If-None-Match": etag}},
+        ]})
+    finally:
+        # The app is shared by every test: don't leave the failing route behind
+        app.router.routes.remove(boom_route)
+    assert response.status_code == 200
+    responses = {r["id"]: r for r in response.json()["responses"]}
+    assert responses["ok"]["status"] == 200 and responses["ok"]["etag"] == etag
+    assert responses["boom"]["status"] == 500
+    assert responses["cached"]["status"] == 304
+
+    assert client.get("/_test-boom").status_code == 404
+
+    outer = client.post("/batch", headers={"If-None-Match": etag}, json={"requests": [{"id": "x", "url": "/recipes?limit=1"}]})
+    assert outer.json()["responses"][0]["status"] == 304
+
+
+def test_plan_meals_route():
+    """/plan-meals is served by the meal planner (validates MealRequest fields)"""
+    response = client.post("/plan-meals", json={})
+    assert response.status_code == 422
+    missing = {err["loc"][-1] for err in response.json()["detail"]}
+    assert {"meals_per_day", "days"} <= missing
+
+
+def test_recipes_etag():
+    """Recipe listing sends an ETag and answers a matching If-None-Match with 304"""
+    response = client.get("/recipes?limit=5")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert client.get("/recipes?limit=5", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/recipes?limit=6", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_embedding_cache(tmp_path):
+    """Embeddings round-trip through the sqlite cache per model, duplicates included"""
+    import numpy as np
+    from utils.embedding_cache import get_cached_embeddings, cache_embeddings
+
+    path = str(tmp_path / "cache.sqlite3")
+    cache_embeddings("model-a", ["tacos", "salad"], np.array([[1, 2], [3, 4]], dtype=np.float32), path=path)
+    found = get_cached_embeddings("model-a", ["salad", "soup", "tacos", "salad"], path=path)
+    assert sorted(found) == [0, 2, 3]
+    assert found[0].tolist() == [3, 4] and found[3].tolist() == [3, 4]
+    assert found[2].dtype == np.float32 and found[2].tolist() == [1, 2]
+    assert get_cached_embeddings("model-b", ["tacos", "salad"], path=path) == {}
+
+
+def test_embed_query_cache(monkeypatch):
+    """A repeated query is served from the query embedding cache without calling the batcher"""
+    import asyncio
+    import numpy as np
+    import utils.embeddings_helper as eh
+
+    calls = []
+
+    async def embed(text):
+        calls.append(text)
+        return np.array([[0.6, 0.8], [1.0, 0.0]], dtype=np.float32)[0]
+
+    monkeypatch.setattr(eh._query_batcher, "embed", embed)
+    monkeypatch.setattr(eh, "_query_embeddings", type(eh._query_embeddings)())
+
+    first = asyncio.run(eh.embed_query("spicy tacos"))
+    second = asyncio.run(eh.embed_query("spicy tacos"))
+    assert calls == ["spicy tacos"]
+    assert second is first and first.base is None and not first.flags.writeable
+
+
+@pytest.fixture
+def fresh_index(monkeypatch):
+    """Empty in-memory embedding index, restored after the test"""
+    import numpy as np
+    import utils.embeddings_helper as eh
+
+    monkeypatch.setattr(eh, "_ids", [])
+    monkeypatch.setattr(eh, "_id_rows", {})
+    monkeypatch.setattr(eh, "_matrix", np.empty((0, 0), dtype=eh.EMBEDDING_DTYPE))
+    monkeypatch.setattr(eh, "_buffer", None)
+    monkeypatch.setattr(eh, "_binary_codes", None)
+    monkeypatch.setattr(eh, "_faiss_index", None)
+    return eh
+
+
+def _unit_rows(n, dim=8, seed=0):
+    import numpy as np
+
+    rows = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_embedding_index_growth_and_persistence(fresh_index, tmp_path):
+    """The index grows past its initial capacity, survives save/load, and stays updatable after an mmap load"""
+    import numpy as np
+
+    eh = fresh_index
+    rows = _unit_rows(21)
+    ids = [f"r{i}" for i in range(20)]
+    assert eh._store_embeddings(ids, rows[:20] * 3) == 20
+    assert len(eh._buffer) >= 20 and eh._matrix.base is eh._buffer
+    assert eh._ids == ids and np.allclose(eh._matrix, rows[:20])
+
+    # Replacing a known id rewrites its row in place
+    assert eh._store_embeddings(["r3"], [rows[20]]) == 1
+    assert len(eh._ids) == 20 and np.allclose(eh._matrix[3], rows[20])
+
+    emb_path, ids_path = str(tmp_path / "emb.npy"), str(tmp_path / "ids.json")
+    assert eh.save_embedding_index("hash", emb_path, ids_path)
+    eh._store_embeddings(["extra"], [rows[0]])
+    assert not eh.load_embedding_index("other-hash", emb_path, ids_path)
+    assert eh.load_embedding_index("hash", emb_path, ids_path)
+    assert eh._ids == ids and not eh._matrix.flags.writeable
+    assert np.allclose(eh._matrix[3], rows[20])
+    assert eh.find_similar_by_embedding(rows[5], 1) == ["r5"]
+
+    # Updating the read-only mapped index copies it first: the file on disk is untouched
+    eh._store_embeddings(["r5"], [rows[6]])
+    assert eh._matrix.flags.writeable and np.allclose(eh._matrix[5], rows[6])
+    assert np.allclose(np.load(emb_path)[5], rows[5])
+
+    eh._store_embeddings(["new"], [rows[7]])
+    assert eh._ids[-1] == "new" and len(eh._matrix) == 21
+    assert eh.find_similar_by_embedding(rows[6], 2)[0] in {"r5", "r6"}
+
+
+def test_binary_codes_rebuilt_after_store(fresh_index, monkeypatch):
+    """A binary-mode search running mid-store doesn't leave the later rows unsearchable"""
+    eh = fresh_index
+    monkeypatch.setattr(eh, "EMBEDDING_SEARCH_MODE", "binary")
+    monkeypatch.setattr(eh, "BINARY_RESCORE_FACTOR", 1)
+    rows = _unit_rows(40, dim=64, seed=2)
+    eh._store_embeddings([f"r{i}" for i in range(20)], rows[:20])
+
+    normalize = eh._normalize
+
+    def normalize_and_search(emb):
+        # Simulates a concurrent search between two rows of the same store call
+        eh.find_similar_by_embedding(rows[0], 1)
+        return normalize(emb)
+
+    monkeypatch.setattr(eh, "_normalize", normalize_and_search)
+    eh._store_embeddings([f"r{i}" for i in range(20, 40)], rows[20:])
+    monkeypatch.setattr(eh, "_normalize", normalize)
+    assert eh.find_similar_by_embedding(rows[39], 1) == ["r39"]
+
+
+@pytest.mark.parametrize("dtype, mode", [("float16", "float32"), ("float32", "binary"), ("float16", "binary")])
+def test_embedding_search_modes(fresh_index, monkeypatch, dtype, mode):
+    """float16 storage and binary shortlisting still rank a recipe's own embedding first"""
+    import numpy as np
+
+    eh = fresh_index
+    monkeypatch.setattr(eh, "EMBEDDING_DTYPE", np.dtype(dtype))
+    monkeypatch.setattr(eh, "_matrix", np.empty((0, 0), dtype=dtype))
+    monkeypatch.setattr(eh, "EMBEDDING_SEARCH_MODE", mode)
+    monkeypatch.setattr(eh, "BINARY_RESCORE_FACTOR", 4)
+
+    rows = _unit_rows(200, dim=64, seed=1)
+    eh._store_embeddings([f"r{i}" for i in range(200)], rows)
+    assert eh._matrix.dtype == np.dtype(dtype)
+    for i in (0, 57, 199):
+        found = eh.find_similar_by_embedding(rows[i], 3)
+        assert len(found) == 3 and found[0] == f"r{i}"
+
+
+def test_nim_cache_skips_unusable_answers(monkeypatch):
+    """Empty, non-JSON, id-less or rejected NIM answers are not replayed from the response cache"""
+    import asyncio
+    import orjson
+    import utils.ai_agent as ai
+
+    answers = iter(["", "Here are some tacos!", '{"recipes": ["r1"]}', '{"ids": ["made-up"]}', '{"ids": ["r1"]}', '{"ids": ["r2"]}'])
+
+    class FakeResponse:
+        def __init__(self, content):
+            self.content = orjson.dumps({"choices": [{"message": {"content": content}}]})
+
+        def raise_for_status(self):
+            pass
+
+    class FakeClient:
+        async def post(self, *args, **kwargs):
+            return FakeResponse(next(answers))
+
+    monkeypatch.setattr(ai, "get_async_client", lambda: FakeClient())
+    monkeypatch.setattr(ai, "_response_cache", type(ai._response_cache)())
+
+    def known(content):
+        return all(i in {"r1", "r2"} for i in orjson.loads(content)["ids"])
+
+    async def ask():
+        return await ai.aquery_nim("pick recipes", json_mode=True, validate=known)
+
+    replies = [asyncio.run(ask()) for _ in range(6)]
+    assert replies[:5] == ["", "Here are some tacos!", '{"recipes": ["r1"]}', '{"ids": ["made-up"]}', '{"ids": ["r1"]}']
+    # The first usable answer is cached from then on
+    assert replies[5] == '{"ids": ["r1"]}'